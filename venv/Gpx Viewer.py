@@ -0,0 +1,242 @@
+from flask import Flask, render_template, request, redirect, url_for, jsonify, abort
+#from flask_sqlalchemy import SQLAlchemy
+import os
+import zipfile
+from models import JOBS_DATABASE_PATH, db_connect, create_table, create_job_table, Track, Driver, Vehicle
+from ingest import Ingestor, delete_track, hash_known
+from jobs import JobQueue, iter_upload, save_stream, keep_upload, discard_upload
+from simplify import MAX_ZOOM
+from point_store import load_points
+from spatial import tracks_in_area, tracks_near
+from rollups import PERIODS, SUBJECTS, query_stats
+from metrics import RequestMetrics
+import numpy as np
+from sqlalchemy.orm import sessionmaker, scoped_session
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///instance/gpx_data.db'
+app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['INGEST_WORKERS'] = 1  # SQLite erlaubt ohnehin nur einen Schreiber
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Laufzeit, SQL-Abfragen und Antwortgröße je Route unter /metrics
+app.config['REQUEST_METRICS'] = os.environ.get('GPX_VIEWER_METRICS') == '1'
+
+# Zoomstufe der Übersicht, die direkt in die Seite eingebettet wird
+OVERVIEW_ZOOM = 10
+
+engine = db_connect()
+create_table(engine)
+# eine Session je Request; /filter und /track lesen über eine eigene
+# Nur-Lese-Engine, damit sie während eines Imports weiterlaufen
+read_engine = db_connect(read_only=True)
+session = scoped_session(sessionmaker(bind=engine))
+read_session = scoped_session(sessionmaker(bind=read_engine))
+ingestor = Ingestor(engine)
+# Jobs in eigener Datei, Uploads warten so nicht auf die Schreibsperre eines Imports
+jobs_engine = db_connect(path=JOBS_DATABASE_PATH)
+create_job_table(jobs_engine)
+job_queue = JobQueue(ingestor, jobs_engine, app.config['INGEST_WORKERS'])
+# der Reloader-Elternprozess von app.run(debug=True) bedient keine Requests und importiert nichts
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    job_queue.resume()
+# Ensure the upload folder exists
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+if app.config['REQUEST_METRICS']:
+    request_metrics = RequestMetrics(app, (engine, read_engine, jobs_engine))
+
+@app.teardown_appcontext
+def remove_sessions(exception=None):
+    session.remove()
+    read_session.remove()
+
+@app.route('/')
+def index():
+    vehicles = session.query(Vehicle.name).distinct().all()
+    drivers = session.query(Driver.name).distinct().all()
+    return render_template('index.html', vehicles=vehicles, drivers=drivers)
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    if 'file' not in request.files:
+        return redirect(url_for('index'))
+
+    uploads = [file for file in request.files.getlist('file') if file.filename != '']
+    if not uploads:
+        return redirect(url_for('index'))
+
+    # Duplikate werden anhand des Inhalts vor dem Parsen abgewiesen
+    files = []
+    duplicates = []
+    errors = []
+    hashes = set()
+    try:
+        for upload in uploads:
+            try:
+                for filename, stream in iter_upload(upload):
+                    temp_path, content_hash = save_stream(stream, app.config['UPLOAD_FOLDER'])
+                    if content_hash in hashes or hash_known(session, content_hash):
+                        discard_upload(temp_path)
+                        duplicates.append(filename)
+                    else:
+                        hashes.add(content_hash)
+                        files.append((keep_upload(temp_path, app.config['UPLOAD_FOLDER'], filename, content_hash), filename, content_hash))
+            except zipfile.BadZipFile as e:
+                errors.append([upload.filename, f'invalid zip archive: {e}'])
+        job_id = job_queue.submit(files, duplicates, errors)
+    except Exception:
+        # ohne Job würden die schon gespeicherten Dateien nie importiert
+        for file_path, filename, content_hash in files:
+            discard_upload(file_path)
+        raise
+
+    return redirect(url_for('job_status', job_id=job_id), code=303)
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error='unknown job'), 404
+    return jsonify(status)
+
+def form_float(name):
+    try:
+        return float(request.form.get(name, ''))
+    except ValueError:
+        return None
+
+@app.route('/filter', methods=['GET', 'POST'])
+def filter_tracks():
+    vehicle_name = request.form.get('vehicle')
+    driver_name = request.form.get('driver')
+    date_from = request.form.get('date_from')
+    date_to = request.form.get('date_to')
+    # Gebiet als Rechteck und/oder Umkreis um einen Punkt
+    min_lat, max_lat = form_float('min_lat'), form_float('max_lat')
+    min_lon, max_lon = form_float('min_lon'), form_float('max_lon')
+    lat, lon, radius = form_float('lat'), form_float('lon'), form_float('radius')
+
+    query = read_session.query(Driver.name,Track.id,Track.name,Track.date,Vehicle.name).join(Track, Driver.id == Track.driver_id).join(Vehicle, Track.vehicle_id == Vehicle.id)
+
+    #query = session.query(Track).join(Vehicle).join(Driver)
+    if vehicle_name:
+        query = query.filter(Vehicle.name == vehicle_name)
+    if driver_name:
+        query = query.filter(Driver.name == driver_name)
+    if date_from:
+        query = query.filter(Track.date >= date_from)
+    if date_to:
+        query = query.filter(Track.date <= date_to)
+    if None not in (min_lat, max_lat, min_lon, max_lon):
+        track_ids = tracks_in_area(read_session, min_lat, min_lon, max_lat, max_lon, query.with_entities(Track.id).statement)
+        query = query.filter(Track.id.in_(track_ids))
+    if None not in (lat, lon, radius):
+        track_ids = tracks_near(read_session, lat, lon, radius, query.with_entities(Track.id).statement)
+        query = query.filter(Track.id.in_(track_ids))
+
+    tracks = query.order_by(Track.date.asc()).all()
+    driver_combinations = {}
+    for track in tracks:
+        driver = track[0]
+        vehicle = track[-1]
+        if driver not in driver_combinations:
+            driver_combinations[driver] = {}
+        if vehicle not in driver_combinations[driver]:
+            driver_combinations[driver][vehicle] = []
+        driver_combinations[driver][vehicle].append(track[1:-1])
+    #print(driver_combinations)
+    return render_template('filtered_tracks.html', tracks = driver_combinations)
+
+def track_coordinates(track_id, zoom=None, bbox=None):
+    """Returns the lines of [lat, lon] pairs of a track needed at a zoom level, optionally limited to a (west, south, east, north) box.
+
+    Without a box the track is a single line. With a box every point inside
+    it is returned together with its neighbours, so the segments crossing the
+    edge are kept, and every part of the track inside the box is a line of its own.
+    """
+    points = load_points(read_session, track_id)
+    selected = np.arange(len(points))
+    if zoom is not None and zoom < MAX_ZOOM:
+        # Punkte ohne Zoomstufe stammen aus älteren Importen und haben 0, werden also immer geliefert
+        selected = np.flatnonzero(points.min_zoom <= zoom)
+    lats, lons = points.lat[selected], points.lon[selected]
+    if len(selected) == 0:
+        return []
+    if bbox is None:
+        return [np.column_stack((lats, lons)).tolist()]
+
+    west, south, east, north = bbox
+    inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+    keep = inside.copy()
+    keep[1:] |= inside[:-1]
+    keep[:-1] |= inside[1:]
+    kept = np.flatnonzero(keep)
+    if len(kept) == 0:
+        return []
+    runs = np.split(kept, np.flatnonzero(np.diff(kept) > 1) + 1)
+    return [np.column_stack((lats[run], lons[run])).tolist() for run in runs]
+
+@app.route('/track/<int:track_id>')
+def view_track(track_id):
+    track = read_session.query(Track).filter(Track.id == track_id).first()
+    if track is None:
+        abort(404)
+    lines = track_coordinates(track_id, OVERVIEW_ZOOM)
+    # Statistiken werden beim Import berechnet und gespeichert
+    total_distance = track.total_distance
+    avg_speed = track.avg_speed
+
+    return render_template('view_track.html', track=track, driver= track.driver, vehicle=track.vehicle,lines=lines, overview_zoom=OVERVIEW_ZOOM, total_distance=total_distance, avg_speed=avg_speed, elevation_gain=track.elevation_gain)
+
+@app.route('/track/<int:track_id>/coords')
+def track_coords(track_id):
+    zoom = request.args.get('zoom', type=int)
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            bbox = [float(value) for value in bbox.split(',')]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4:
+            return jsonify(error='bbox must be west,south,east,north'), 400
+    else:
+        bbox = None
+    if read_session.query(Track.id).filter(Track.id == track_id).first() is None:
+        return jsonify(error='unknown track'), 404
+
+    return jsonify(track_id=track_id, zoom=zoom, lines=track_coordinates(track_id, zoom, bbox))
+
+@app.route('/track/<int:track_id>/delete', methods=['POST'])
+def remove_track(track_id):
+    with ingestor.engine.begin() as conn:
+        deleted = delete_track(conn, track_id)
+    if not deleted:
+        abort(404)
+    return redirect(url_for('index'))
+
+@app.route('/stats')
+def stats():
+    by = request.args.get('by', 'driver')
+    period = request.args.get('period', 'month')
+    if by not in SUBJECTS or period not in PERIODS:
+        return jsonify(error='by must be driver or vehicle, period one of day, week, month'), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+
+    rows, has_more = query_stats(session, by, period, request.args.get('name'), request.args.get('date_from'), request.args.get('date_to'), page, per_page)
+    results = [{'name': name,
+                'period_start': period_start.isoformat(),
+                'distance': round(distance, 2),
+                'driving_time': round(driving_time / 3600, 2),  # Stunden
+                'track_count': track_count,
+                'avg_speed': round(distance / (driving_time / 3600), 2) if driving_time > 0 else 0,
+                'max_speed': max_speed}
+               for name, period_start, distance, driving_time, track_count, max_speed in rows]
+    return jsonify(by=by, period=period, page=page, per_page=per_page, next_page=page + 1 if has_more else None, results=results)
+
+if __name__ == '__main__':
+    #with app.app_context():
+        #db.drop_all()
+        #db.create_all()
+    #app.run(host='0.0.0.0',debug=True,port=5000)
+    app.run(debug=True)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of parsing, ingestion, distance calculation and the track views.
+
+  python bench.py [--tracks 50] [--points 20000] [--output bench.json]
+
+Runs on the sample files in ../GeoKoordinaten plus synthetic GPX files of
+--points points each, inside a temporary working directory with its own
+database. For every stage the throughput and, unless --no-memory is given,
+the peak memory above what was allocated before are reported as JSON; the
+memory is traced with tracemalloc in a second run of each stage. The route stages go through the Flask test
+client with request metrics enabled, whose per-route totals are included.
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import sqlalchemy
+from sqlalchemy import func, select
+
+from models import db_connect, create_table, Track, TrackPoints, Driver
+from gpx_parser import parse_gpx, iter_gpx
+from geo import calculate_total_distance
+from simplify import MAX_ZOOM
+from ingest import Ingestor, file_hash
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = os.path.join(HERE, os.pardir, 'GeoKoordinaten')
+DRIVERS = 20
+VEHICLES = 10
+
+class Stage:
+  """Sums wall time and peak traced memory of the measured sections of one stage."""
+
+  def __init__(self, unit):
+    self.unit = unit
+    self.items = 0
+    self.seconds = 0.0
+    self.peak = None
+
+  @contextmanager
+  def measure(self):
+    traced = tracemalloc.is_tracing()
+    if traced:
+      baseline = tracemalloc.get_traced_memory()[0]
+      tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.seconds += time.perf_counter() - started
+      if traced:
+        self.peak = max(self.peak or 0, tracemalloc.get_traced_memory()[1] - baseline)
+
+  def result(self):
+    return {
+      'items': self.items,
+      'unit': self.unit,
+      'seconds': round(self.seconds, 4),
+      'per_second': round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+      'peak_memory_mb': round(self.peak / 1e6, 2) if self.peak is not None else None,
+    }
+
+def write_synthetic_gpx(file_path, points, seed):
+  """Writes one track of points seconds of driving as a random walk somewhere in Germany."""
+  rng = np.random.default_rng(seed)
+  heading = np.cumsum(rng.normal(0, 0.05, points)) + rng.uniform(0, 2 * math.pi)
+  step = np.clip(rng.normal(60, 15, points), 0, 130) / 3600  # km je Sekunde
+  lat = 48 + rng.uniform(0, 6) + np.cumsum(step * np.cos(heading)) / 111.2
+  lon = 7 + rng.uniform(0, 7) + np.cumsum(step * np.sin(heading)) / (111.2 * np.cos(np.radians(lat)))
+  ele = 200 + np.cumsum(rng.normal(0, 0.3, points))
+  start = np.datetime64('2023-01-01T06:00:00') + np.timedelta64(int(rng.integers(0, 365 * 86400)), 's')
+  times = np.datetime_as_string(start + np.arange(points).astype('timedelta64[s]'), unit='s')
+
+  with open(file_path, 'w') as f:
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="bench.py" xmlns="http://www.topografix.com/GPX/1/1">\n'
+            f'<trk><name>Synthetisch {seed}</name><trkseg>\n')
+    f.writelines(f'<trkpt lat="{a:.7f}" lon="{o:.7f}"><ele>{e:.1f}</ele><time>{t}Z</time></trkpt>\n'
+                 for a, o, e, t in zip(lat.tolist(), lon.tolist(), ele.tolist(), times.tolist()))
+    f.write('</trkseg></trk>\n</gpx>\n')
+
+def synthetic_files(directory, tracks, points, seed=0):
+  """Writes tracks synthetic files named like the uploads, spread over DRIVERS drivers and VEHICLES vehicles."""
+  os.makedirs(directory, exist_ok=True)
+  file_paths = []
+  for i in range(tracks):
+    file_path = os.path.join(directory, f'S{i % DRIVERS:02d}_SYN{i % VEHICLES:02d}_{i:05d}.gpx')
+    write_synthetic_gpx(file_path, points, seed + i)
+    file_paths.append(file_path)
+  return file_paths
+
+def load_viewer():
+  """Imports the Flask app from 'Gpx Viewer.py' into the current working directory."""
+  spec = importlib.util.spec_from_file_location('gpx_viewer', os.path.join(HERE, 'Gpx Viewer.py'))
+  module = importlib.util.module_from_spec(spec)
+  # Flask findet die Templates über das Modul in sys.modules
+  sys.modules[spec.name] = module
+  spec.loader.exec_module(module)
+  return module
+
+def traced(function, *args):
+  """Runs a benchmark function with tracemalloc enabled."""
+  tracemalloc.start()
+  try:
+    return function(*args)
+  finally:
+    tracemalloc.stop()
+
+def with_memory(stages, traced_stages):
+  for name, stage in traced_stages.items():
+    stages[name].peak = stage.peak
+  return stages
+
+def measured(function, args, memory, traced_args=None):
+  """Runs a benchmark function for its timings and, if memory is set, a second time traced for the peak memory.
+
+  tracemalloc slows Python code down several times, so the throughput is
+  always taken from the untraced run.
+  """
+  stages = function(*args)
+  if memory:
+    with_memory(stages, traced(function, *(traced_args or args)))
+  return stages
+
+def bench_parse(file_paths):
+  stages = {'parse_gpx': Stage('points'), 'iter_gpx': Stage('points')}
+  for file_path in file_paths:
+    try:
+      with stages['parse_gpx'].measure():
+        tracks = parse_gpx(file_path)
+      stages['parse_gpx'].items += sum(len(track[0]) for track in tracks)
+      with stages['iter_gpx'].measure():
+        for track, chunk, last in iter_gpx(file_path):
+          stages['iter_gpx'].items += len(chunk)
+    except Exception as e:
+      print(f'Skipping {file_path}: {e}', file=sys.stderr)
+  return stages
+
+def bench_ingest(ingestor, file_paths):
+  stage = Stage('points')
+  for file_path in file_paths:
+    content_hash = file_hash(file_path)
+    try:
+      with stage.measure():
+        stage.items += ingestor.ingest_file(file_path, content_hash=content_hash)
+    except Exception as e:
+      print(f'Skipping {file_path}: {e}', file=sys.stderr)
+  return {'ingest': stage}
+
+def bench_distance(file_paths):
+  stage = Stage('points')
+  for file_path in file_paths:
+    try:
+      tracks = parse_gpx(file_path)
+    except Exception:
+      continue
+    for coordinates, *_ in tracks:
+      with stage.measure():
+        calculate_total_distance(coordinates)
+      stage.items += len(coordinates)
+  return {'calculate_total_distance': stage}
+
+def _request(client, stage, method, url, data=None):
+  with stage.measure():
+    response = client.open(url, method=method, data=data)
+    response.get_data()
+  if response.status_code != 200:
+    raise RuntimeError(f'{method} {url}: {response.status_code}')
+  stage.items += 1
+
+def bench_filter(client, conn, repeat):
+  """POST /filter without filters, for one driver, for an area and a radius around the center of a track."""
+  tracks = Track.__table__
+  drivers = Driver.__table__
+  driver_name = conn.execute(select(drivers.c.name).join(tracks, tracks.c.driver_id == drivers.c.id)
+                             .group_by(drivers.c.id).order_by(func.count().desc()).limit(1)).scalar()
+  track = conn.execute(select(tracks).where(tracks.c.min_lat.is_not(None)).order_by(tracks.c.id).limit(1)).first()
+  lat = (track.min_lat + track.max_lat) / 2
+  lon = (track.min_lon + track.max_lon) / 2
+  variants = {
+    'all': {},
+    'driver': {'driver': driver_name},
+    'area': {'min_lat': lat - 0.05, 'max_lat': lat + 0.05, 'min_lon': lon - 0.05, 'max_lon': lon + 0.05},
+    'radius': {'lat': lat, 'lon': lon, 'radius': 5},
+  }
+  stages = {}
+  for name, data in variants.items():
+    stage = stages[f'filter_tracks:{name}'] = Stage('requests')
+    for _ in range(repeat):
+      _request(client, stage, 'POST', '/filter', data)
+  return stages
+
+def bench_view(client, conn, views):
+  """GET /track/<id> and the full detail of /track/<id>/coords for up to views tracks spread over all tracks."""
+  track_ids = conn.execute(select(Track.__table__.c.id).order_by(Track.__table__.c.id)).scalars().all()
+  if len(track_ids) > views:
+    track_ids = [track_ids[i] for i in np.linspace(0, len(track_ids) - 1, views).astype(int)]
+  stages = {'view_track': Stage('requests'), 'track_coords': Stage('requests')}
+  for track_id in track_ids:
+    _request(client, stages['view_track'], 'GET', f'/track/{track_id}')
+    _request(client, stages['track_coords'], 'GET', f'/track/{track_id}/coords?zoom={MAX_ZOOM}')
+  return stages
+
+def bench_routes(client, conn, repeat, views):
+  stages = bench_filter(client, conn, repeat)
+  stages.update(bench_view(client, conn, views))
+  return stages
+
+def run(args):
+  samples = []
+  if args.samples:
+    samples = sorted(os.path.join(os.path.abspath(args.samples), name) for name in os.listdir(args.samples) if name.lower().endswith('.gpx'))
+  workdir = args.workdir or tempfile.mkdtemp(prefix='gpx-bench-')
+  os.makedirs(os.path.join(workdir, 'instance'), exist_ok=True)
+  cwd = os.getcwd()
+  os.chdir(workdir)
+  try:
+    synthetic = synthetic_files('synthetic', args.tracks, args.points, args.seed)
+    file_paths = samples + synthetic
+    os.environ['GPX_VIEWER_METRICS'] = '1'
+    viewer = load_viewer()
+
+    memory = not args.no_memory
+    stages = {}
+    stages.update(measured(bench_parse, (file_paths,), memory))
+    # der Durchlauf mit tracemalloc schreibt in eine eigene Datenbank
+    traced_ingestor = None
+    if memory:
+      traced_ingestor = Ingestor(db_connect(path='instance/traced.db'))
+      create_table(traced_ingestor.engine)
+    stages.update(measured(bench_ingest, (viewer.ingestor, file_paths), memory, (traced_ingestor, file_paths)))
+    stages.update(measured(bench_distance, (file_paths,), memory))
+    client = viewer.app.test_client()
+    with viewer.read_engine.connect() as conn:
+      stages.update(bench_routes(client, conn, args.repeat, args.views))
+      routes = viewer.request_metrics.snapshot()
+      if memory:
+        with_memory(stages, traced(bench_routes, client, conn, args.repeat, args.views))
+      tracks, points = conn.execute(select(func.count(), func.sum(TrackPoints.__table__.c.count))
+                                    .select_from(Track.__table__).outerjoin(TrackPoints.__table__)).one()
+
+    return {
+      'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'sqlalchemy': sqlalchemy.__version__,
+                      'platform': platform.platform()},
+      'dataset': {'sample_files': len(samples), 'synthetic_files': len(synthetic), 'points_per_synthetic_track': args.points,
+                  'seed': args.seed, 'bytes': sum(os.path.getsize(p) for p in file_paths), 'tracks': tracks, 'points': points or 0},
+      'stages': {name: stage.result() for name, stage in stages.items()},
+      'routes': routes,
+    }
+  finally:
+    os.chdir(cwd)
+    if not args.workdir and not args.keep:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark parsing, ingestion, distances and the track views.')
+  parser.add_argument('--samples', default=SAMPLES if os.path.isdir(SAMPLES) else None, help='directory of sample GPX files (default: ../GeoKoordinaten)')
+  parser.add_argument('--no-samples', dest='samples', action='store_const', const=None, help='only use synthetic files')
+  parser.add_argument('--tracks', type=int, default=50, help='number of synthetic tracks, one file each (default: 50)')
+  parser.add_argument('--points', type=int, default=20000, help='points per synthetic track (default: 20000)')
+  parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic tracks')
+  parser.add_argument('--repeat', type=int, default=5, help='requests per /filter variant (default: 5)')
+  parser.add_argument('--views', type=int, default=100, help='number of tracks requested from /track (default: 100)')
+  parser.add_argument('--no-memory', action='store_true', help='do not trace memory; tracemalloc slows down every stage')
+  parser.add_argument('--workdir', help='directory for the database and synthetic files, kept afterwards (default: a temporary directory)')
+  parser.add_argument('--keep', action='store_true', help='keep the temporary directory')
+  parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+  args = parser.parse_args()
+
+  report = json.dumps(run(args), indent=2)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(report + '\n')
+  else:
+    print(report)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,141 @@
+import calendar
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371  # Earth radius in kilometers
+SPEED_WINDOW = 30  # Sekunden, über die die Höchstgeschwindigkeit gemittelt wird
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Calculate the great-circle distance between two points on the Earth."""
+    R = EARTH_RADIUS
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return R * c
+
+def _haversine_arrays(phi1, lam1, phi2, lam2):
+  a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+  return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def segment_distances(lats, lons):
+  """Great-circle distances in km between consecutive points, computed for the whole array at once."""
+  phi = np.radians(np.asarray(lats, dtype=float))
+  lam = np.radians(np.asarray(lons, dtype=float))
+  return _haversine_arrays(phi[:-1], lam[:-1], phi[1:], lam[1:])
+
+def distances_from(lat, lon, lats, lons):
+  """Great-circle distances in km from one point to every point of the arrays."""
+  return _haversine_arrays(math.radians(lat), math.radians(lon), np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float)))
+
+def epoch_seconds(time):
+  """Seconds since 1970 as float; naive datetimes are taken as UTC, None becomes NaN."""
+  if time is None:
+    return np.nan
+  return calendar.timegm(time.utctimetuple()) + time.microsecond / 1e6
+
+def profile_arrays(lats, lons, eles, times):
+  """Per-point statistics for whole point arrays.
+
+  eles and times (epoch seconds) may contain NaN for missing values.
+  Returns (distances, speeds, elevation_gain): the distance in km from the
+  preceding point (0 for the first), the speed in km/h on that segment (NaN
+  where the times are missing or not increasing) and the summed ascent in
+  meters.
+  """
+  if len(lats) == 0:
+    return np.zeros(0), np.zeros(0), 0.0
+
+  distances = np.concatenate(([0.0], segment_distances(lats, lons)))
+  seconds = np.concatenate(([np.nan], np.diff(np.asarray(times, dtype=float))))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    speeds = np.where(seconds > 0, distances / seconds * 3600, np.nan)
+  climbs = np.diff(np.asarray(eles, dtype=float))
+  elevation_gain = float(np.sum(climbs[climbs > 0]))
+  return distances, speeds, elevation_gain
+
+def profile(coordinates, previous=None):
+  """profile_arrays for a run of (lat, lon, ele, speed, time) coordinates.
+
+  The first point is measured from previous if given.
+  """
+  points = list(coordinates)
+  if previous is not None:
+    points.insert(0, previous)
+  n = len(points)
+
+  lats = np.fromiter((p[0] for p in points), dtype=float, count=n)
+  lons = np.fromiter((p[1] for p in points), dtype=float, count=n)
+  eles = np.fromiter((p[2] if p[2] is not None else np.nan for p in points), dtype=float, count=n)
+  times = np.fromiter((epoch_seconds(p[4]) for p in points), dtype=float, count=n)
+  distances, speeds, elevation_gain = profile_arrays(lats, lons, eles, times)
+
+  if previous is not None:
+    return distances[1:], speeds[1:], elevation_gain
+  return distances, speeds, elevation_gain
+
+def window_speeds(lats, lons, times, window=SPEED_WINDOW):
+  """Average speeds in km/h from every point to the first point at least window seconds later.
+
+  The distance is measured straight between the two points, so GPS fixes
+  jumping away in between do not count. times are epoch seconds; points
+  without time are left out and times going backwards are held at their
+  previous maximum.
+  """
+  times = np.asarray(times, dtype=float)
+  valid = ~np.isnan(times)
+  times = np.maximum.accumulate(times[valid]) if valid.any() else times[valid]
+  lats = np.asarray(lats, dtype=float)[valid]
+  lons = np.asarray(lons, dtype=float)[valid]
+  end = np.searchsorted(times, times + window)
+  start = np.flatnonzero(end < len(times))
+  end = end[start]
+  distances = _haversine_arrays(np.radians(lats[start]), np.radians(lons[start]), np.radians(lats[end]), np.radians(lons[end]))
+  return distances / (times[end] - times[start]) * 3600
+
+def max_speed(lats, lons, times, window=SPEED_WINDOW):
+  """Highest speed held over window seconds, or None if the track is shorter than that.
+
+  The speeds of single segments are useless for this: between fixes one
+  second apart a few meters of GPS jitter already mean hundreds of km/h.
+  A fix jumping away still distorts the windows starting or ending at it,
+  so a window speed only counts as far as both neighbouring windows confirm it.
+  """
+  speeds = window_speeds(lats, lons, times, window)
+  if len(speeds) == 0:
+    return None
+  if len(speeds) < 3:
+    return float(speeds.min())
+  return float(np.minimum(np.minimum(speeds[:-2], speeds[1:-1]), speeds[2:]).max())
+
+def path_length(coordinates, previous=None):
+  """Unrounded length in km of a run of coordinates, optionally continuing from a previous point."""
+  points = list(coordinates)
+  if previous is not None:
+    points.insert(0, previous)
+  if len(points) < 2:
+    return 0
+  return float(np.sum(segment_distances([p[0] for p in points], [p[1] for p in points])))
+
+def calculate_total_distance(coordinates):
+  total_distance = 0
+  if len(coordinates) > 1:
+    total_distance = round(path_length(coordinates),2)
+
+  return total_distance
+
+def calculate_avg_speed(total_distance, start_time, end_time):
+  avg_speed = 0
+  if total_distance != 0 and start_time is not None and end_time is not None:
+    track_time = (end_time - start_time).total_seconds()/3600 #Umwandlung von Sekunden in Stunden
+    #print(track_time)
+    # nur ein Zeitstempel oder alle Punkte mit derselben Zeit
+    if track_time <= 0:
+      return 0
+    avg_speed = round(total_distance/track_time,2)
+  return avg_speed
@@ -0,0 +1,132 @@
+import xml.etree.ElementTree as ET
+
+from gpxpy.gpxfield import TimeConverter
+
+CHUNK_SIZE = 5000
+
+_time_converter = TimeConverter()
+
+class ParsedTrack:
+  """A track or the waypoint set of a GPX file while it is being streamed.
+
+  name, start_time and end_time are final once its last chunk was yielded.
+  """
+
+  def __init__(self, name, type):
+    self.name = name
+    self.type = type
+    self.start_time = None
+    self.end_time = None
+    self.points = 0
+
+  def add(self, point):
+    time = point[4]
+    if time is not None:
+      if self.start_time is None or time < self.start_time:
+        self.start_time = time
+      if self.end_time is None or time > self.end_time:
+        self.end_time = time
+    self.points += 1
+
+def _track_name(name, default):
+  # Namen wie "2011.01.04" sind nur Zeitstempel des Geräts und werden ersetzt
+  if not name or (name[0].isdigit() and name[-1].isdigit()):
+    return default
+  return name
+
+def _float(value):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+def _local(tag):
+  return tag.rsplit('}', 1)[-1]
+
+def iter_gpx(file_path, chunk_size=CHUNK_SIZE):
+  """Streams a GPX file as (ParsedTrack, points, last) triples.
+
+  points is a list of at most chunk_size (lat, lon, ele, speed, time) tuples.
+  last is True for the final chunk of every track, whose point list may be
+  empty. Waypoints are collected into one set named like the last waypoint.
+  """
+  waypoints = None
+  waypoint_chunk = []
+  track = None
+  chunk = []
+  point = None
+  stack = []
+
+  with open(file_path, 'rb') as gpx_file:
+    for event, elem in ET.iterparse(gpx_file, events=('start', 'end')):
+      tag = _local(elem.tag)
+      if event == 'start':
+        parent = _local(stack[-1].tag) if stack else None
+        if tag == 'trk':
+          # GPX lists waypoints before tracks, so the set is written out first
+          if waypoint_chunk:
+            yield waypoints, waypoint_chunk, False
+            waypoint_chunk = []
+          track = ParsedTrack('Strecke', 'Strecke')
+        elif (tag == 'trkpt' and parent == 'trkseg') or (tag == 'wpt' and parent == 'gpx'):
+          lat = _float(elem.get('lat'))
+          lon = _float(elem.get('lon'))
+          # Punkte ohne gültige Position werden wie bei gpxpy übersprungen
+          point = [lat, lon, None, None, None, None] if lat is not None and lon is not None else None
+        stack.append(elem)
+        continue
+
+      stack.pop()
+      parent = _local(stack[-1].tag) if stack else None
+      if tag == 'trkpt':
+        if point is not None:
+          coordinate = (point[0], point[1], point[2], point[3], point[4])
+          track.add(coordinate)
+          chunk.append(coordinate)
+          point = None
+          if len(chunk) >= chunk_size:
+            yield track, chunk, False
+            chunk = []
+        stack[-1].remove(elem)
+      elif tag == 'wpt':
+        if point is not None:
+          if waypoints is None:
+            waypoints = ParsedTrack('Wegpunkte', 'Wegpunkt')
+          waypoints.name = _track_name(point[5], 'Wegpunkte')
+          coordinate = (point[0], point[1], point[2], 0.0, point[4])
+          waypoints.add(coordinate)
+          waypoint_chunk.append(coordinate)
+          point = None
+          if len(waypoint_chunk) >= chunk_size:
+            yield waypoints, waypoint_chunk, False
+            waypoint_chunk = []
+        stack[-1].remove(elem)
+      elif tag == 'trk' and track is not None:
+        yield track, chunk, True
+        track = None
+        chunk = []
+        stack[-1].remove(elem)
+      elif point is not None and parent in ('trkpt', 'wpt'):
+        text = elem.text.strip() if elem.text else ''
+        if tag == 'ele':
+          point[2] = _float(text)
+        elif tag == 'speed':
+          point[3] = _float(text)
+        elif tag == 'time':
+          point[4] = _time_converter.from_string(text)
+        elif tag == 'name':
+          point[5] = elem.text
+      elif tag == 'name' and parent == 'trk' and track is not None:
+        track.name = _track_name(elem.text, 'Strecke')
+
+  if waypoints is not None:
+    yield waypoints, waypoint_chunk, True
+
+def parse_gpx(file_path):
+    """Parses a GPX file and extracts coordinates."""
+    tracks = {}
+    for track, chunk, last in iter_gpx(file_path):
+        tracks.setdefault(track, []).extend(chunk)
+
+    waypoints = [(coordinates, track.start_time, track.end_time, track.name, track.type) for track, coordinates in tracks.items() if track.type == 'Wegpunkt']
+    return waypoints + [(coordinates, track.start_time, track.end_time, track.name, track.type) for track, coordinates in tracks.items() if track.type == 'Strecke']
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Bulk ingestion of GPX files into the track database.
+
+Can also be run as a script to import a whole directory of GPX files:
+
+  python ingest.py ../GeoKoordinaten --workers 4
+"""
+import argparse
+import hashlib
+import itertools
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from sqlalchemy import select
+
+from models import db_connect, create_table, Track, TrackPoints, Coordinate, Driver, Vehicle
+from gpx_parser import iter_gpx
+import numpy as np
+
+from geo import SPEED_WINDOW, profile, epoch_seconds, max_speed, calculate_avg_speed
+from simplify import min_zooms
+from point_store import PointArrays, join_encoded, store_encoded
+from spatial import index_points, set_track_bbox, delete_track_tiles
+from rollups import apply_track, remove_track
+
+BATCH_SIZE = 5000
+
+class _OpenTrack:
+  def __init__(self, track_id):
+    self.track_id = track_id
+    self.distance = 0
+    self.elevation_gain = 0
+    self.last = None
+    self.parts = []  # encode()-Werte der bisherigen Chunks
+    self.count = 0
+    self.bbox = None
+    self.max_speed = None
+    self.window = None  # (lats, lons, times) der letzten SPEED_WINDOW Sekunden
+
+def split_filename(filename):
+  """Returns (driver_name, vehicle_name) encoded in a file name like AA_WITAA333_003.gpx."""
+  splitted_filename = os.path.basename(filename).split('_')
+  if len(splitted_filename) < 2:
+    raise ValueError(f'{os.path.basename(filename)} is not named like DRIVER_VEHICLE_NNN.gpx')
+  return splitted_filename[0], splitted_filename[1]
+
+class Ingestor:
+  """Writes parsed tracks with batched Core inserts and caches driver/vehicle ids.
+
+  With columnar=True the points of a track go into one TrackPoints row (see
+  point_store), otherwise into one coordinate row per point. The single row
+  means the encoded columns of a track (33 bytes per point) are kept in
+  memory until its last chunk; only the parsed points stay bounded by the
+  chunk size.
+  """
+
+  def __init__(self, engine, batch_size=BATCH_SIZE, columnar=True):
+    self.engine = engine
+    self.batch_size = batch_size
+    self.columnar = columnar
+    self._driver_ids = {}
+    self._vehicle_ids = {}
+
+  def _lookup_id(self, conn, model, cache, name):
+    if name in cache:
+      return cache[name]
+    table = model.__table__
+    row_id = conn.execute(select(table.c.id).where(table.c.name == name)).scalar()
+    if row_id is None:
+      row_id = conn.execute(table.insert().values(name=name)).inserted_primary_key[0]
+    cache[name] = row_id
+    return row_id
+
+  def ingest(self, file_path, chunks, filename=None, content_hash=None, progress=None):
+    """Stores the streamed (ParsedTrack, points, last) triples of one file in a single transaction.
+
+    Coordinate rows are written while the file is still being parsed, column
+    arrays and the track row are completed once its last chunk arrives.
+    progress is called with the number of points written so far after every
+    chunk. Returns the number of points written.
+    """
+    driver_name, vehicle_name = split_filename(filename or file_path)
+    points = 0
+    with self.engine.begin() as conn:
+      try:
+        driver_id = self._lookup_id(conn, Driver, self._driver_ids, driver_name)
+        vehicle_id = self._lookup_id(conn, Vehicle, self._vehicle_ids, vehicle_name)
+        open_tracks = {}
+        for track, chunk, last in chunks:
+          state = open_tracks.get(track)
+          if state is None:
+            state = open_tracks[track] = _OpenTrack(self._insert_track(conn, file_path, driver_id, vehicle_id, track, content_hash))
+          if chunk:
+            self._insert_coordinates(conn, state, chunk)
+            points += len(chunk)
+            if progress is not None:
+              progress(points)
+          if last:
+            self._finish_track(conn, state, track)
+            del open_tracks[track]
+      except Exception:
+        # ids created inside the failed transaction are rolled back as well
+        self._driver_ids.clear()
+        self._vehicle_ids.clear()
+        raise
+    return points
+
+  def ingest_file(self, file_path, filename=None, content_hash=None, progress=None):
+    return self.ingest(file_path, iter_gpx(file_path), filename, content_hash, progress)
+
+  def _insert_track(self, conn, file_path, driver_id, vehicle_id, track, content_hash):
+    result = conn.execute(Track.__table__.insert().values(name=track.name, type=track.type, file_path=file_path, content_hash=content_hash, vehicle_id=vehicle_id, driver_id=driver_id))
+    return result.inserted_primary_key[0]
+
+  def _finish_track(self, conn, state, track):
+    start_time = track.start_time
+    track_date = date(start_time.year,start_time.month,start_time.day) if not start_time is None else None
+
+    total_distance = 0
+    avg_speed = 0
+    if track.points > 1:
+      total_distance = round(state.distance,2)
+      if track.type == 'Strecke':
+        avg_speed = calculate_avg_speed(total_distance, track.start_time, track.end_time)
+
+    if state.parts:
+      store_encoded(conn, state.track_id, join_encoded(state.parts))
+    set_track_bbox(conn, state.track_id, state.bbox)
+
+    table = Track.__table__
+    max_speed = round(state.max_speed,2) if state.max_speed is not None else None
+    conn.execute(table.update().where(table.c.id == state.track_id).values(name=track.name, date=track_date, total_distance=total_distance, avg_speed=avg_speed, start_time=track.start_time, end_time=track.end_time,
+                                                                         elevation_gain=round(state.elevation_gain,1), max_speed=max_speed))
+    apply_track(conn, conn.execute(select(table).where(table.c.id == state.track_id)).one())
+
+  def _index_tiles(self, conn, state, coordinates):
+    # der letzte Punkt des vorherigen Chunks gehört mit in die erste Kachel
+    offset = state.count - 1 if state.last is not None else 0
+    points = [state.last] + list(coordinates) if state.last is not None else coordinates
+    bbox = index_points(conn, state.track_id, [p[0] for p in points], [p[1] for p in points], offset)
+    if state.bbox is None:
+      state.bbox = bbox
+    else:
+      state.bbox = (min(state.bbox[0], bbox[0]), max(state.bbox[1], bbox[1]), min(state.bbox[2], bbox[2]), max(state.bbox[3], bbox[3]))
+    state.count += len(coordinates)
+
+  def _update_max_speed(self, state, coordinates):
+    n = len(coordinates)
+    lats = np.fromiter((c[0] for c in coordinates), dtype=float, count=n)
+    lons = np.fromiter((c[1] for c in coordinates), dtype=float, count=n)
+    times = np.fromiter((epoch_seconds(c[4]) for c in coordinates), dtype=float, count=n)
+    if state.window is not None:
+      # Fenster, die im vorherigen Chunk beginnen, enden erst in diesem
+      lats, lons, times = (np.concatenate(pair) for pair in zip(state.window, (lats, lons, times)))
+    speed = max_speed(lats, lons, times)
+    if speed is not None:
+      state.max_speed = max(state.max_speed or 0, speed)
+    valid = ~np.isnan(times)
+    if valid.any():
+      tail = valid & (times >= np.nanmax(times) - SPEED_WINDOW)
+      state.window = (lats[tail], lons[tail], times[tail])
+
+  def _insert_coordinates(self, conn, state, coordinates):
+    self._index_tiles(conn, state, coordinates)
+    distances, speeds, elevation_gain = profile(coordinates, state.last)
+    cumulative = state.distance + np.cumsum(distances)
+    state.distance = float(cumulative[-1])
+    state.elevation_gain += elevation_gain
+    state.last = coordinates[-1]
+    self._update_max_speed(state, coordinates)
+    # vereinfacht wird je Chunk, die Chunkgrenzen bleiben auf allen Zoomstufen erhalten
+    zooms = min_zooms([c[0] for c in coordinates], [c[1] for c in coordinates])
+    if self.columnar:
+      # schon kodiert, so belegt ein offener Track nur die Größe seiner Blobs
+      state.parts.append(PointArrays.from_coordinates(coordinates, cumulative, speeds, zooms).encode())
+      return
+
+    insert = Coordinate.__table__.insert()
+    batch = []
+    for (lat, lon, ele, speed, time), distance, segment_speed, min_zoom in zip(coordinates, cumulative.tolist(), speeds.tolist(), zooms.tolist()):
+      # executemany needs the same keys in every row, so the server default for ele is applied here
+      batch.append({'lat': lat, 'lon': lon, 'ele': ele if ele is not None else 0.0, 'speed': speed, 'time': time,
+                    'distance': distance, 'segment_speed': None if math.isnan(segment_speed) else segment_speed, 'min_zoom': min_zoom, 'track_id': state.track_id})
+      if len(batch) >= self.batch_size:
+        conn.execute(insert, batch)
+        batch = []
+    if batch:
+      conn.execute(insert, batch)
+
+def delete_track(conn, track_id):
+  """Removes a track with its points, tiles and rollup contribution. Returns False if it does not exist."""
+  table = Track.__table__
+  track = conn.execute(select(table).where(table.c.id == track_id)).first()
+  if track is None:
+    return False
+  remove_track(conn, track)
+  delete_track_tiles(conn, track_id)
+  conn.execute(TrackPoints.__table__.delete().where(TrackPoints.__table__.c.track_id == track_id))
+  conn.execute(Coordinate.__table__.delete().where(Coordinate.__table__.c.track_id == track_id))
+  conn.execute(table.delete().where(table.c.id == track_id))
+  return True
+
+def file_hash(file_path):
+  """SHA-256 of a file's content as hex string."""
+  digest = hashlib.sha256()
+  with open(file_path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def known_file_path(conn, content_hash):
+  """File path of a stored track with this content, or None."""
+  table = Track.__table__
+  return conn.execute(select(table.c.file_path).where(table.c.content_hash == content_hash).limit(1)).scalar()
+
+def hash_known(conn, content_hash):
+  return known_file_path(conn, content_hash) is not None
+
+def _parse_worker(file_path):
+  try:
+    return file_path, list(iter_gpx(file_path)), None
+  except Exception as e:
+    return file_path, None, e
+
+def import_directory(directory, engine, workers=None, columnar=True):
+  """Parses all GPX files of a directory in a process pool and ingests them.
+
+  Files whose path or content is already stored in the database are skipped
+  before parsing; files that cannot be parsed or ingested are skipped and
+  reported on stderr. At most two files per worker are parsed ahead of the
+  ingestion, so the parsed points waiting in memory stay bounded.
+  Returns (files, points, seconds).
+  """
+  tracks = Track.__table__
+  with engine.connect() as conn:
+    known_paths = set(conn.execute(select(tracks.c.file_path).distinct()).scalars())
+    known_hashes = set(conn.execute(select(tracks.c.content_hash).distinct().where(tracks.c.content_hash.is_not(None))).scalars())
+  hashes = {}
+  for name in sorted(os.listdir(directory)):
+    file_path = os.path.join(directory, name)
+    if not name.lower().endswith('.gpx') or file_path in known_paths:
+      continue
+    content_hash = file_hash(file_path)
+    if content_hash not in known_hashes:
+      known_hashes.add(content_hash)
+      hashes[file_path] = content_hash
+  file_paths = list(hashes)
+
+  ingestor = Ingestor(engine, columnar=columnar)
+  files = 0
+  points = 0
+  started = time.perf_counter()
+  workers = workers or os.cpu_count() or 1
+  remaining = iter(file_paths)
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = deque(pool.submit(_parse_worker, file_path) for file_path in itertools.islice(remaining, 2 * workers))
+    while pending:
+      file_path, chunks, error = pending.popleft().result()
+      next_path = next(remaining, None)
+      if next_path is not None:
+        pending.append(pool.submit(_parse_worker, next_path))
+      if error is None:
+        try:
+          points += ingestor.ingest(file_path, chunks, content_hash=hashes[file_path])
+          files += 1
+        except Exception as e:
+          error = e
+      if error is not None:
+        print(f'Skipping {file_path}: {error}', file=sys.stderr)
+  return files, points, time.perf_counter() - started
+
+def main():
+  parser = argparse.ArgumentParser(description='Import a directory of GPX files into the track database.')
+  parser.add_argument('directory', help='directory containing the GPX files')
+  parser.add_argument('--workers', type=int, default=None, help='number of parser processes (default: CPU count)')
+  parser.add_argument('--rows', action='store_true', help='store one coordinate row per point instead of column arrays')
+  args = parser.parse_args()
+
+  engine = db_connect()
+  create_table(engine)
+  files, points, seconds = import_directory(args.directory, engine, args.workers, not args.rows)
+  rate = points / seconds if seconds > 0 else 0
+  print(f'{files} files, {points} points in {seconds:.2f} s ({rate:.0f} points/s)')
+
+if __name__ == '__main__':
+  main()
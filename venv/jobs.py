@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Background ingestion of uploaded GPX files.
+
+Uploads are saved and hashed in the request, then handed to a JobQueue whose
+worker threads run the Ingestor. Files whose content is already stored are
+rejected before they are parsed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from models import IngestJob
+from ingest import known_file_path
+
+def save_stream(stream, upload_folder):
+  """Writes a stream into the upload folder while hashing it.
+
+  Returns (file_path, content_hash). file_path is a temporary '.part' file
+  until keep_upload or discard_upload is called.
+  """
+  digest = hashlib.sha256()
+  with tempfile.NamedTemporaryFile(dir=upload_folder, suffix='.part', delete=False) as f:
+    try:
+      for block in iter(lambda: stream.read(1 << 20), b''):
+        digest.update(block)
+        f.write(block)
+    except Exception:
+      f.close()
+      os.remove(f.name)
+      raise
+  return f.name, digest.hexdigest()
+
+def keep_upload(temp_path, upload_folder, filename, content_hash):
+  """Moves a saved upload to its final name, which gets a hash suffix if the name is taken."""
+  file_path = os.path.join(upload_folder, filename)
+  if os.path.exists(file_path):
+    stem, ext = os.path.splitext(filename)
+    file_path = os.path.join(upload_folder, f'{stem}_{content_hash[:8]}{ext}')
+  os.replace(temp_path, file_path)
+  return file_path
+
+def discard_upload(file_path):
+  # beim Fortsetzen eines Jobs kann die Datei schon entfernt sein
+  if os.path.exists(file_path):
+    os.remove(file_path)
+
+def iter_upload(storage):
+  """Yields (filename, stream) for an uploaded GPX file or every GPX file inside an uploaded zip archive."""
+  filename = secure_filename(storage.filename)
+  if not filename.lower().endswith('.zip'):
+    yield filename, storage.stream
+    return
+  with zipfile.ZipFile(storage.stream) as archive:
+    for info in archive.infolist():
+      name = secure_filename(os.path.basename(info.filename))
+      if not info.is_dir() and name.lower().endswith('.gpx'):
+        with archive.open(info) as member:
+          yield name, member
+
+class JobQueue:
+  """Runs ingest jobs on a thread pool and keeps their status in the ingest_job table.
+
+  The jobs live in their own database (engine), so submitting a job and
+  reporting progress never wait for the write lock an ingest holds on the
+  track database. Every file is ingested in its own transaction, so resume
+  can continue the jobs of a previous process after the files they had
+  finished.
+  """
+
+  def __init__(self, ingestor, engine, workers=1):
+    self.ingestor = ingestor
+    self.engine = engine
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+
+  def submit(self, files, duplicates=(), errors=()):
+    """Queues a batch of (file_path, filename, content_hash) tuples and returns the job id.
+
+    duplicates and errors ([filename, message] pairs) are uploads already
+    rejected in the request; they are reported with the job.
+    """
+    table = IngestJob.__table__
+    with self.engine.begin() as conn:
+      job_id = conn.execute(table.insert().values(status='queued', files=len(files), duplicates=json.dumps(list(duplicates)),
+                                                  errors=json.dumps(list(errors)), file_list=json.dumps(files),
+                                                  created_at=datetime.now())).inserted_primary_key[0]
+    self.executor.submit(self._run, job_id, files, list(duplicates), list(errors))
+    return job_id
+
+  def resume(self):
+    """Queues the jobs a previous process left queued or running again. Returns their ids."""
+    table = IngestJob.__table__
+    with self.engine.connect() as conn:
+      jobs = conn.execute(select(table).where(table.c.status.in_(('queued', 'running'))).order_by(table.c.id)).all()
+    for job in jobs:
+      errors = json.loads(job.errors or '[]')
+      if job.file_list is None:
+        # Jobs von vor file_list lassen sich nicht fortsetzen
+        errors.append([None, 'interrupted by a restart'])
+        self._update(job.id, status='failed', errors=json.dumps(errors), finished_at=datetime.now())
+        continue
+      files = [tuple(file) for file in json.loads(job.file_list)]
+      self.executor.submit(self._run, job.id, files, json.loads(job.duplicates or '[]'), errors, job.files_done, job.points)
+    return [job.id for job in jobs]
+
+  def _update(self, job_id, **values):
+    table = IngestJob.__table__
+    with self.engine.begin() as conn:
+      conn.execute(table.update().where(table.c.id == job_id).values(**values))
+
+  def _run(self, job_id, files, duplicates, errors, files_done=0, points=0):
+    try:
+      self._process(job_id, files, duplicates, errors, files_done, points)
+    except Exception as e:
+      errors.append([None, str(e)])
+      self._update(job_id, status='failed', duplicates=json.dumps(duplicates), errors=json.dumps(errors), finished_at=datetime.now())
+
+  def _process(self, job_id, files, duplicates, errors, files_done, points):
+    self._update(job_id, status='running')
+    for file_path, filename, content_hash in files[files_done:]:
+      with self.ingestor.engine.connect() as conn:
+        stored_path = known_file_path(conn, content_hash)
+      if stored_path == file_path:
+        # vor einem Neustart importiert, aber nicht mehr als erledigt gezählt
+        pass
+      elif stored_path is not None:
+        # gleicher Inhalt wurde inzwischen von einem anderen Job importiert
+        duplicates.append(filename)
+        discard_upload(file_path)
+      else:
+        def progress(file_points, done=points):
+          self._update(job_id, points=done + file_points)
+        try:
+          points += self.ingestor.ingest_file(file_path, filename, content_hash, progress)
+        except Exception as e:
+          errors.append([filename, str(e)])
+          discard_upload(file_path)
+      files_done += 1
+      self._update(job_id, files_done=files_done, points=points, duplicates=json.dumps(duplicates), errors=json.dumps(errors))
+
+    status = 'failed' if errors and points == 0 else 'done'
+    self._update(job_id, status=status, finished_at=datetime.now())
+
+  def status(self, job_id):
+    """Status of a job as dict, or None if there is no such job."""
+    table = IngestJob.__table__
+    with self.engine.connect() as conn:
+      job = conn.execute(select(table).where(table.c.id == job_id)).first()
+    if job is None:
+      return None
+    return {
+      'id': job.id,
+      'status': job.status,
+      'files': job.files,
+      'files_done': job.files_done,
+      'points': job.points,
+      'duplicates': json.loads(job.duplicates or '[]'),
+      'errors': json.loads(job.errors or '[]'),
+      'created_at': job.created_at.isoformat(),
+      'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
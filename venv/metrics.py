@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Per-route request metrics.
+
+When REQUEST_METRICS is enabled, RequestMetrics records for every route the
+request latency, the number and duration of the SQL statements it ran and
+the size of the response. The totals are served as JSON at /metrics.
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+SAMPLES = 1000  # letzte Latenzen je Route für die Perzentile
+
+class RouteStats:
+  def __init__(self):
+    self.requests = 0
+    self.latency = 0.0
+    self.max_latency = 0.0
+    self.queries = 0
+    self.query_time = 0.0
+    self.bytes = 0
+    self.latencies = deque(maxlen=SAMPLES)
+
+  def add(self, latency, queries, query_time, size):
+    self.requests += 1
+    self.latency += latency
+    self.max_latency = max(self.max_latency, latency)
+    self.queries += queries
+    self.query_time += query_time
+    self.bytes += size
+    self.latencies.append(latency)
+
+  def as_dict(self):
+    """Totals and per-request averages; times in milliseconds."""
+    p50, p95 = np.percentile(self.latencies, [50, 95]) if self.latencies else (0.0, 0.0)
+    return {
+      'requests': self.requests,
+      'latency_ms': {'mean': round(self.latency / self.requests * 1000, 3), 'p50': round(p50 * 1000, 3),
+                     'p95': round(p95 * 1000, 3), 'max': round(self.max_latency * 1000, 3)},
+      'queries': self.queries,
+      'queries_per_request': round(self.queries / self.requests, 2),
+      'query_time_ms': round(self.query_time * 1000, 3),
+      'bytes': self.bytes,
+      'bytes_per_request': round(self.bytes / self.requests),
+    }
+
+class RequestMetrics:
+  """Collects RouteStats keyed by 'METHOD /rule' for an app and the engines its routes use.
+
+  SQL statements are only counted while a request is handled in the same
+  thread, so background ingest jobs are not attributed to routes.
+  """
+
+  def __init__(self, app=None, engines=()):
+    self.routes = {}
+    self._lock = threading.Lock()
+    if app is not None:
+      self.init_app(app, engines)
+
+  def init_app(self, app, engines):
+    app.before_request(self._start)
+    app.after_request(self._finish)
+    for engine in engines:
+      event.listen(engine, 'before_cursor_execute', self._before_execute)
+      event.listen(engine, 'after_cursor_execute', self._after_execute)
+    app.add_url_rule('/metrics', 'metrics', self.view)
+
+  def _start(self):
+    if request.endpoint == 'metrics':
+      return
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_time = 0.0
+
+  def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_started' in g:
+      conn.info['metrics_query_started'] = time.perf_counter()
+
+  def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_query_started', None)
+    if started is not None and has_request_context() and 'metrics_started' in g:
+      g.metrics_queries += 1
+      g.metrics_query_time += time.perf_counter() - started
+
+  def _finish(self, response):
+    if 'metrics_started' not in g:
+      return response
+    latency = time.perf_counter() - g.metrics_started
+    route = f'{request.method} {request.url_rule.rule}' if request.url_rule is not None else f'{request.method} <unmatched>'
+    with self._lock:
+      stats = self.routes.setdefault(route, RouteStats())
+      stats.add(latency, g.metrics_queries, g.metrics_query_time, response.calculate_content_length() or 0)
+    return response
+
+  def snapshot(self):
+    with self._lock:
+      return {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+
+  def reset(self):
+    with self._lock:
+      self.routes.clear()
+
+  def view(self):
+    return jsonify(routes=self.snapshot())
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Converts the coordinate rows of an existing database into the column store.
+
+  python migrate_points.py [--keep-rows] [--max-speed] [--vacuum]
+
+Every track that has coordinate rows but no TrackPoints row is converted in
+its own transaction, so the migration can be interrupted and resumed.
+Tracks missing from the spatial index are added to it afterwards, and older
+tracks get the content hash of their uploaded file if it still exists.
+--max-speed recomputes the maximum speed of all tracks, which imports before
+geo.max_speed took from single segments, and rebuilds the rollups.
+"""
+import argparse
+import os
+
+import numpy as np
+from sqlalchemy import select, text
+
+from models import db_connect, create_table, Track, Coordinate, TrackPoints
+from geo import profile_arrays, max_speed
+from simplify import min_zooms
+from point_store import PointArrays, load_points, store_points
+from spatial import index_missing
+from ingest import file_hash
+from rollups import rebuild
+
+def migrate_track(conn, track_id, keep_rows=False):
+  """Writes the coordinate rows of one track as column arrays. Returns the number of points."""
+  c = Coordinate.__table__.c
+  rows = conn.execute(select(c.lat, c.lon, c.ele, c.speed, c.time, c.distance, c.segment_speed, c.min_zoom)
+                      .where(c.track_id == track_id).order_by(c.id)).all()
+  if not rows:
+    return 0
+
+  points = PointArrays.from_rows(rows)
+  # ältere Importe haben noch keine Strecke, Geschwindigkeit und Zoomstufe je Punkt
+  distances, speeds, elevation_gain = profile_arrays(points.lat, points.lon, points.ele, points.time)
+  points.distance = np.cumsum(distances)
+  points.segment_speed = speeds
+  points.min_zoom = min_zooms(points.lat, points.lon).astype(np.uint8)
+  store_points(conn, track_id, points)
+
+  track = Track.__table__
+  conn.execute(track.update().where(track.c.id == track_id, track.c.elevation_gain.is_(None)).values(elevation_gain=round(elevation_gain,1)))
+  speed = max_speed(points.lat, points.lon, points.time)
+  if speed is not None:
+    conn.execute(track.update().where(track.c.id == track_id, track.c.max_speed.is_(None)).values(max_speed=round(speed,2)))
+  if not keep_rows:
+    conn.execute(Coordinate.__table__.delete().where(c.track_id == track_id))
+  return len(points)
+
+def migrate(engine, keep_rows=False):
+  """Migrates all tracks still stored as coordinate rows. Returns (tracks, points)."""
+  c = Coordinate.__table__.c
+  with engine.connect() as conn:
+    track_ids = conn.execute(select(c.track_id).distinct()
+                             .where(c.track_id.not_in(select(TrackPoints.__table__.c.track_id)))).scalars().all()
+  tracks = 0
+  points = 0
+  for track_id in track_ids:
+    with engine.begin() as conn:
+      points += migrate_track(conn, track_id, keep_rows)
+    tracks += 1
+  return tracks, points
+
+def recompute_max_speeds(engine):
+  """Sets the maximum speed of every track again from its stored points. Returns the number of tracks.
+
+  Imports before geo.max_speed stored the fastest single segment, which GPS
+  jitter drives up to hundreds of km/h.
+  """
+  table = Track.__table__
+  with engine.connect() as conn:
+    track_ids = conn.execute(select(table.c.id)).scalars().all()
+  for track_id in track_ids:
+    with engine.begin() as conn:
+      points = load_points(conn, track_id)
+      speed = max_speed(points.lat, points.lon, points.time)
+      conn.execute(table.update().where(table.c.id == track_id).values(max_speed=round(speed,2) if speed is not None else None))
+  return len(track_ids)
+
+def backfill_hashes(engine):
+  """Sets the content hash of older tracks whose uploaded file still exists. Returns the number of files hashed."""
+  table = Track.__table__
+  with engine.connect() as conn:
+    file_paths = conn.execute(select(table.c.file_path).distinct().where(table.c.content_hash.is_(None))).scalars().all()
+  hashed = 0
+  for file_path in file_paths:
+    # ältere Einträge unter Windows enthalten Backslashes
+    local_path = file_path.replace('\\', os.sep)
+    if not os.path.exists(local_path):
+      continue
+    with engine.begin() as conn:
+      conn.execute(table.update().where(table.c.file_path == file_path).values(content_hash=file_hash(local_path)))
+    hashed += 1
+  return hashed
+
+def main():
+  parser = argparse.ArgumentParser(description='Convert coordinate rows into per-track column arrays.')
+  parser.add_argument('--keep-rows', action='store_true', help='keep the coordinate rows after converting them')
+  parser.add_argument('--max-speed', action='store_true', help='recompute the maximum speed of all tracks and rebuild the rollups')
+  parser.add_argument('--vacuum', action='store_true', help='run VACUUM afterwards to shrink the database file')
+  args = parser.parse_args()
+
+  engine = db_connect()
+  create_table(engine)
+  database = engine.url.database
+  size_before = os.path.getsize(database)
+
+  tracks, points = migrate(engine, args.keep_rows)
+  indexed = index_missing(engine)
+  hashed = backfill_hashes(engine)
+  if args.max_speed:
+    print(f'{recompute_max_speeds(engine)} maximum speeds recomputed, {rebuild(engine)} tracks aggregated')
+  if args.vacuum:
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+      conn.execute(text('VACUUM'))
+
+  size_after = os.path.getsize(database)
+  print(f'{tracks} tracks, {points} points migrated, {indexed} tracks indexed, {hashed} files hashed; {database}: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy                 import create_engine, event, inspect, text, Column, Table, ForeignKey, Index, UniqueConstraint, MetaData, SmallInteger, Integer, String, Date, DateTime, Float, Boolean, Text, Numeric, DateTime, LargeBinary
+from sqlalchemy.orm             import relationship, sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+JobBase = declarative_base()
+
+DATABASE_PATH = 'instance/gpx_data.db'
+# Import-Jobs liegen in einer eigenen Datei, damit das Einreihen nicht auf die
+# Schreibsperre eines laufenden Imports warten muss
+JOBS_DATABASE_PATH = 'instance/jobs.db'
+BUSY_TIMEOUT = 30000  # ms; ein Import hält die Schreibsperre für die Dauer einer Datei
+
+def db_connect(read_only=False, path=DATABASE_PATH):
+  """Pooled engine for the track database, or for the database at path.
+
+  Connections use WAL, so readers are not blocked by an import. With
+  read_only=True the database is opened with mode=ro; that engine must only
+  be created after create_table has run on a writing engine.
+  """
+  if read_only:
+    engine = create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+  else:
+    engine = create_engine(f"sqlite:///{path}")
+
+  @event.listens_for(engine, 'connect')
+  def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+      # der Journal-Modus bleibt in der Datei gespeichert und gilt dann auch für Leser
+      cursor.execute('PRAGMA journal_mode=WAL')
+      cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT}')
+    cursor.close()
+
+  return engine
+  
+# R-tree der Track-Kacheln (siehe spatial.py); eigene MetaData, damit create_all
+# die virtuelle Tabelle nicht als normale Tabelle anlegt
+rtree_metadata = MetaData()
+track_tile_rtree = Table('track_tile_rtree', rtree_metadata,
+  Column('id', Integer, primary_key=True),
+  Column('min_lat', Float),
+  Column('max_lat', Float),
+  Column('min_lon', Float),
+  Column('max_lon', Float),
+  Column('track_id', Integer),
+  Column('first', Integer),
+  Column('last', Integer),
+)
+
+def create_table(engine):
+  Base.metadata.create_all(engine)
+  upgrade_schema(engine)
+  backfill_track_types(engine)
+  with engine.begin() as conn:
+    conn.execute(text('CREATE VIRTUAL TABLE IF NOT EXISTS track_tile_rtree USING rtree('
+                      'id, min_lat, max_lat, min_lon, max_lon, +track_id, +first, +last)'))
+
+def upgrade_schema(engine):
+  """Adds columns and indexes introduced after a database was created; create_all only creates missing tables."""
+  inspector = inspect(engine)
+  with engine.begin() as conn:
+    for table in Base.metadata.sorted_tables:
+      existing = {column['name'] for column in inspector.get_columns(table.name)}
+      for column in table.columns:
+        if column.name not in existing:
+          column_type = column.type.compile(engine.dialect)
+          default = f" DEFAULT '{column.server_default.arg}'" if column.server_default is not None else ''
+          conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+      for index in table.indexes:
+        index.create(conn, checkfirst=True)
+  
+def backfill_track_types(engine):
+  """Sets the type of tracks imported before Track.type existed. Returns the number of tracks updated.
+
+  Those imports stored waypoint sets with a speed of exactly 0 for every
+  coordinate and an average speed of 0; everything else is a Strecke. This
+  must run before migrate_points.py moves the coordinate rows into the
+  column store, which create_table ensures.
+  """
+  with engine.begin() as conn:
+    return conn.execute(text(
+      "UPDATE track SET type = CASE WHEN avg_speed = 0"
+      " AND EXISTS (SELECT 1 FROM coordinate WHERE coordinate.track_id = track.id)"
+      " AND NOT EXISTS (SELECT 1 FROM coordinate WHERE coordinate.track_id = track.id AND (speed IS NULL OR speed != 0))"
+      " THEN 'Wegpunkt' ELSE 'Strecke' END"
+      " WHERE type IS NULL")).rowcount
+
+class Track(Base):
+  __tablename__ = "track"
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  name = Column(String(150), nullable=True)
+  file_path = Column(String(200), nullable=False, index=True)
+  content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 der hochgeladenen Datei
+  vehicle_id = Column(Integer, ForeignKey('vehicle.id'), nullable=False, index=True)
+  driver_id = Column(Integer, ForeignKey('driver.id'), nullable=False, index=True)
+  date = Column(Date, nullable=True, index=True)
+  total_distance = Column(Float, nullable=False, server_default='0')
+  avg_speed = Column(Float, nullable=False, server_default='0')
+  start_time = Column(DateTime, nullable=True)
+  end_time = Column(DateTime, nullable=True)
+  elevation_gain = Column(Float, nullable=True)
+  max_speed = Column(Float, nullable=True)
+  type = Column(String(20), nullable=True)      # 'Strecke' oder 'Wegpunkt'
+  min_lat = Column(Float, nullable=True)
+  max_lat = Column(Float, nullable=True)
+  min_lon = Column(Float, nullable=True)
+  max_lon = Column(Float, nullable=True)
+
+  coordinates = relationship('Coordinate', backref='track', lazy=True)
+  points = relationship('TrackPoints', back_populates='track', uselist=False, lazy=True)
+  driver = relationship('Driver', back_populates='track')
+  vehicle = relationship('Vehicle', back_populates='track')
+  
+class Coordinate(Base):
+  __tablename__ = 'coordinate'
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  lat = Column(Float, nullable=False)
+  lon = Column(Float, nullable=False)
+  ele = Column(Float, nullable=False, server_default='0.0')
+  speed = Column(Float, nullable=True)
+  time = Column(DateTime, nullable=True)
+  distance = Column(Float, nullable=True)       # kumulierte Strecke ab Trackbeginn in km
+  segment_speed = Column(Float, nullable=True)  # km/h seit dem vorherigen Punkt
+  min_zoom = Column(SmallInteger, nullable=True) # ab dieser Zoomstufe wird der Punkt gezeichnet
+  track_id = Column(Integer, ForeignKey('track.id'), nullable=False)
+
+  __table_args__ = (Index('ix_coordinate_track_zoom', 'track_id', 'min_zoom'),)
+    
+class TrackPoints(Base):
+  """All points of a track as binary column arrays, see point_store."""
+  __tablename__ = 'track_points'
+  track_id = Column(Integer, ForeignKey('track.id'), primary_key=True)
+  count = Column(Integer, nullable=False)
+  lat = Column(LargeBinary, nullable=False)
+  lon = Column(LargeBinary, nullable=False)
+  ele = Column(LargeBinary, nullable=False)
+  speed = Column(LargeBinary, nullable=False)
+  time = Column(LargeBinary, nullable=False)
+  distance = Column(LargeBinary, nullable=False)
+  segment_speed = Column(LargeBinary, nullable=False)
+  min_zoom = Column(LargeBinary, nullable=False)
+
+  track = relationship('Track', back_populates='points')
+    
+class FleetRollup(Base):
+  """Statistics of one driver or vehicle for one day, week or month, see rollups.py."""
+  __tablename__ = 'fleet_rollup'
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  subject = Column(String(10), nullable=False)     # 'driver' oder 'vehicle'
+  subject_id = Column(Integer, nullable=False)
+  period = Column(String(5), nullable=False)       # 'day', 'week' oder 'month'
+  period_start = Column(Date, nullable=False)
+  distance = Column(Float, nullable=False, server_default='0')
+  driving_time = Column(Float, nullable=False, server_default='0')  # Sekunden
+  track_count = Column(Integer, nullable=False, server_default='0')
+  max_speed = Column(Float, nullable=True)
+
+  __table_args__ = (UniqueConstraint('subject', 'subject_id', 'period', 'period_start', name='uq_fleet_rollup'),
+                    Index('ix_fleet_rollup_period', 'subject', 'period', 'period_start'))
+    
+def create_job_table(engine):
+  JobBase.metadata.create_all(engine)
+
+class IngestJob(JobBase):
+  """A batch of uploaded files processed in the background, see jobs.py; stored in JOBS_DATABASE_PATH."""
+  __tablename__ = 'ingest_job'
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  status = Column(String(10), nullable=False)      # queued, running, done, failed
+  files = Column(Integer, nullable=False, server_default='0')
+  files_done = Column(Integer, nullable=False, server_default='0')
+  points = Column(Integer, nullable=False, server_default='0')
+  duplicates = Column(Text, nullable=True)         # JSON-Liste der abgewiesenen Dateinamen
+  errors = Column(Text, nullable=True)             # JSON-Liste von [Dateiname, Fehler]
+  file_list = Column(Text, nullable=True)          # JSON-Liste von [Pfad, Dateiname, Hash], zum Fortsetzen nach einem Neustart
+  created_at = Column(DateTime, nullable=False)
+  finished_at = Column(DateTime, nullable=True)
+
+class Driver(Base):
+  __tablename__ = 'driver'
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  name = Column(String, nullable=False)
+
+  track = relationship('Track', back_populates='driver')
+  
+class Vehicle(Base):
+  __tablename__ = 'vehicle'
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  name = Column(String, nullable=False)
+
+  track = relationship('Track', back_populates='vehicle')
@@ -0,0 +1,122 @@
+"""Columnar storage of track points.
+
+Instead of one coordinate row per point, all points of a track are kept in a
+single TrackPoints row with one little-endian binary column per field. The
+columns decode with numpy.frombuffer without copying.
+"""
+import numpy as np
+from sqlalchemy import select
+
+from models import Coordinate, TrackPoints
+from geo import epoch_seconds
+
+COORDINATE_SCALE = 10 ** 7  # lat/lon als Ganzzahl in 1e-7 Grad (ca. 1 cm)
+
+# Spalte -> Datentyp im Blob
+COLUMNS = {
+  'lat': '<i4',
+  'lon': '<i4',
+  'ele': '<f4',
+  'speed': '<f4',
+  'time': '<f8',
+  'distance': '<f8',
+  'segment_speed': '<f4',
+  'min_zoom': 'u1',
+}
+
+class PointArrays:
+  """The points of a track as parallel arrays.
+
+  lat/lon are in degrees, time in epoch seconds and distance cumulative in km.
+  Missing ele, speed, time and segment_speed values are NaN.
+  """
+
+  def __init__(self, lat, lon, ele, speed, time, distance, segment_speed, min_zoom):
+    self.lat = lat
+    self.lon = lon
+    self.ele = ele
+    self.speed = speed
+    self.time = time
+    self.distance = distance
+    self.segment_speed = segment_speed
+    self.min_zoom = min_zoom
+
+  def __len__(self):
+    return len(self.lat)
+
+  @classmethod
+  def from_coordinates(cls, coordinates, distance, segment_speed, min_zoom):
+    """Builds arrays from (lat, lon, ele, speed, time) tuples and the precomputed per-point values."""
+    n = len(coordinates)
+    return cls(
+      np.fromiter((c[0] for c in coordinates), dtype=float, count=n),
+      np.fromiter((c[1] for c in coordinates), dtype=float, count=n),
+      np.fromiter((c[2] if c[2] is not None else np.nan for c in coordinates), dtype=float, count=n),
+      np.fromiter((c[3] if c[3] is not None else np.nan for c in coordinates), dtype=float, count=n),
+      np.fromiter((epoch_seconds(c[4]) for c in coordinates), dtype=float, count=n),
+      np.asarray(distance, dtype=float),
+      np.asarray(segment_speed, dtype=float),
+      np.asarray(min_zoom, dtype=np.uint8),
+    )
+
+  @classmethod
+  def concatenate(cls, parts):
+    return cls(*(np.concatenate([getattr(part, name) for part in parts]) for name in COLUMNS))
+
+  def encode(self):
+    """Returns the values for a TrackPoints row."""
+    values = {'count': len(self)}
+    for name, dtype in COLUMNS.items():
+      array = getattr(self, name)
+      if name in ('lat', 'lon'):
+        array = np.round(array * COORDINATE_SCALE)
+      values[name] = np.ascontiguousarray(array, dtype=dtype).tobytes()
+    return values
+
+  @classmethod
+  def decode(cls, row):
+    """Builds arrays on top of the blobs of a TrackPoints row; only lat/lon are scaled into new arrays."""
+    arrays = {name: np.frombuffer(getattr(row, name), dtype=dtype, count=row.count) for name, dtype in COLUMNS.items()}
+    arrays['lat'] = arrays['lat'] / COORDINATE_SCALE
+    arrays['lon'] = arrays['lon'] / COORDINATE_SCALE
+    return cls(**arrays)
+
+  @classmethod
+  def from_rows(cls, rows):
+    """Builds arrays from coordinate rows of the row store (lat, lon, ele, speed, time, distance, segment_speed, min_zoom)."""
+    n = len(rows)
+    def column(index, convert=lambda value: value, dtype=float, missing=np.nan):
+      return np.fromiter((convert(row[index]) if row[index] is not None else missing for row in rows), dtype=dtype, count=n)
+    return cls(column(0), column(1), column(2), column(3), column(4, epoch_seconds),
+               column(5), column(6), column(7, dtype=np.uint8, missing=0))
+
+def load_points(conn, track_id):
+  """Loads the points of a track from the column store, or from coordinate rows for tracks not yet migrated.
+
+  conn may be a Connection or a Session.
+  """
+  table = TrackPoints.__table__
+  row = conn.execute(select(table).where(table.c.track_id == track_id)).first()
+  if row is not None:
+    return PointArrays.decode(row)
+
+  c = Coordinate.__table__.c
+  rows = conn.execute(select(c.lat, c.lon, c.ele, c.speed, c.time, c.distance, c.segment_speed, c.min_zoom)
+                      .where(c.track_id == track_id).order_by(c.id)).all()
+  return PointArrays.from_rows(rows)
+
+def join_encoded(parts):
+  """Joins the encode() values of consecutive runs of points into the values for the whole track.
+
+  The columns have a fixed width per point, so the blobs can simply be concatenated.
+  """
+  values = {'count': sum(part['count'] for part in parts)}
+  for name in COLUMNS:
+    values[name] = b''.join(part[name] for part in parts)
+  return values
+
+def store_encoded(conn, track_id, values):
+  conn.execute(TrackPoints.__table__.insert().values(track_id=track_id, **values))
+
+def store_points(conn, track_id, points):
+  store_encoded(conn, track_id, points.encode())
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Materialized daily, weekly and monthly statistics per driver and vehicle.
+
+The FleetRollup rows are updated incrementally when a track is ingested or
+removed, so dashboard queries never have to aggregate the track table.
+Existing databases can be filled once with:
+
+  python rollups.py --rebuild
+"""
+import argparse
+from datetime import timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from models import db_connect, create_table, Track, Driver, Vehicle, FleetRollup
+
+PERIODS = ('day', 'week', 'month')
+SUBJECTS = {'driver': Driver, 'vehicle': Vehicle}
+
+def period_bounds(day, period):
+  """First day of the period containing day and the first day after it."""
+  if period == 'day':
+    return day, day + timedelta(days=1)
+  if period == 'week':
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
+  start = day.replace(day=1)
+  end = (start + timedelta(days=32)).replace(day=1)
+  return start, end
+
+def _counts(track):
+  # Wegpunkt-Sammlungen sind keine Fahrten; ältere Importe bekommen ihren Typ in models.backfill_track_types
+  return track.date is not None and track.type == 'Strecke'
+
+def _driving_time(track):
+  if track.start_time is None or track.end_time is None:
+    return 0.0
+  return (track.end_time - track.start_time).total_seconds()
+
+def apply_track(conn, track):
+  """Adds a track row to the rollups of its driver and vehicle."""
+  if not _counts(track):
+    return
+  table = FleetRollup.__table__
+  for subject in SUBJECTS:
+    for period in PERIODS:
+      stmt = insert(table).values(subject=subject, subject_id=getattr(track, f'{subject}_id'), period=period,
+                                  period_start=period_bounds(track.date, period)[0], distance=track.total_distance,
+                                  driving_time=_driving_time(track), track_count=1, max_speed=track.max_speed)
+      conn.execute(stmt.on_conflict_do_update(
+        index_elements=['subject', 'subject_id', 'period', 'period_start'],
+        set_={
+          'distance': table.c.distance + stmt.excluded.distance,
+          'driving_time': table.c.driving_time + stmt.excluded.driving_time,
+          'track_count': table.c.track_count + 1,
+          # max() von SQLite liefert NULL, sobald ein Argument NULL ist
+          'max_speed': func.max(func.coalesce(table.c.max_speed, stmt.excluded.max_speed),
+                                func.coalesce(stmt.excluded.max_speed, table.c.max_speed)),
+        }))
+
+def remove_track(conn, track):
+  """Takes a track row out of the rollups; must run before the track row is deleted.
+
+  Sums are decremented, the maximum speed of every affected period is
+  looked up again among the remaining tracks of that period.
+  """
+  if not _counts(track):
+    return
+  table = FleetRollup.__table__
+  tracks = Track.__table__
+  for subject in SUBJECTS:
+    subject_id = getattr(track, f'{subject}_id')
+    subject_column = tracks.c[f'{subject}_id']
+    for period in PERIODS:
+      start, end = period_bounds(track.date, period)
+      max_speed = (select(func.max(tracks.c.max_speed))
+                   .where(subject_column == subject_id, tracks.c.date >= start, tracks.c.date < end,
+                          tracks.c.id != track.id, tracks.c.type == 'Strecke')
+                   .scalar_subquery())
+      bucket = (table.c.subject == subject, table.c.subject_id == subject_id, table.c.period == period, table.c.period_start == start)
+      conn.execute(table.update().where(*bucket).values(
+        distance=table.c.distance - track.total_distance,
+        driving_time=table.c.driving_time - _driving_time(track),
+        track_count=table.c.track_count - 1,
+        max_speed=max_speed))
+      conn.execute(table.delete().where(*bucket, table.c.track_count <= 0))
+
+def rebuild(engine):
+  """Recomputes all rollups from the track table. Returns the number of tracks counted."""
+  tracks = 0
+  with engine.begin() as conn:
+    conn.execute(FleetRollup.__table__.delete())
+    for track in conn.execute(select(Track.__table__)):
+      if _counts(track):
+        apply_track(conn, track)
+        tracks += 1
+  return tracks
+
+def query_stats(conn, by='driver', period='month', name=None, date_from=None, date_to=None, page=1, per_page=50):
+  """One page of rollups, newest period first. Returns (rows, has_more)."""
+  table = FleetRollup.__table__
+  subject = SUBJECTS[by].__table__
+  query = (select(subject.c.name, table.c.period_start, table.c.distance, table.c.driving_time, table.c.track_count, table.c.max_speed)
+           .join(subject, subject.c.id == table.c.subject_id)
+           .where(table.c.subject == by, table.c.period == period))
+  if name:
+    query = query.where(subject.c.name == name)
+  if date_from:
+    query = query.where(table.c.period_start >= date_from)
+  if date_to:
+    query = query.where(table.c.period_start <= date_to)
+  rows = conn.execute(query.order_by(table.c.period_start.desc(), table.c.subject_id)
+                      .limit(per_page + 1).offset((page - 1) * per_page)).all()
+  return rows[:per_page], len(rows) > per_page
+
+def main():
+  parser = argparse.ArgumentParser(description='Maintain the per driver/vehicle rollups.')
+  parser.add_argument('--rebuild', action='store_true', help='recompute all rollups from the stored tracks')
+  args = parser.parse_args()
+  if not args.rebuild:
+    parser.print_help()
+    return
+
+  engine = db_connect()
+  create_table(engine)
+  print(f'{rebuild(engine)} tracks aggregated')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,69 @@
+"""Douglas-Peucker simplification of tracks into map zoom levels.
+
+Every point gets the smallest Leaflet zoom level at which it is needed, so a
+view at zoom z only has to load the points with min_zoom <= z.
+"""
+import numpy as np
+
+from geo import EARTH_RADIUS
+
+MAX_ZOOM = 19
+METERS_PER_PIXEL = 156543.03  # Web-Mercator bei Zoomstufe 0 am Äquator
+
+def _project(lats, lons):
+  """Equirectangular projection to meters, accurate enough for the extent of a track."""
+  lats = np.asarray(lats, dtype=float)
+  lons = np.asarray(lons, dtype=float)
+  scale = EARTH_RADIUS * 1000
+  x = np.radians(lons) * scale * np.cos(np.radians(lats.mean()))
+  y = np.radians(lats) * scale
+  return x, y
+
+def significance(x, y, tolerance=0.0):
+  """Douglas-Peucker significance of every point in meters.
+
+  A point is kept by a Douglas-Peucker run with tolerance t exactly if its
+  significance is greater than t. The endpoints are always kept (inf), points
+  below tolerance are never split off and keep 0.
+  """
+  n = len(x)
+  result = np.zeros(n)
+  if n == 0:
+    return result
+  result[0] = result[-1] = np.inf
+  stack = [(0, n - 1, np.inf)]
+  while stack:
+    first, last, parent = stack.pop()
+    if last - first < 2:
+      continue
+    xs = x[first + 1:last] - x[first]
+    ys = y[first + 1:last] - y[first]
+    dx = x[last] - x[first]
+    dy = y[last] - y[first]
+    norm = np.hypot(dx, dy)
+    if norm == 0:
+      distances = np.hypot(xs, ys)
+    else:
+      distances = np.abs(dy * xs - dx * ys) / norm
+    i = int(np.argmax(distances))
+    if distances[i] <= tolerance:
+      continue
+    index = first + 1 + i
+    # ein Punkt ist nie bedeutsamer als der Punkt, der sein Teilstück abgetrennt hat
+    result[index] = min(distances[i], parent)
+    stack.append((first, index, result[index]))
+    stack.append((index, last, result[index]))
+  return result
+
+def min_zooms(lats, lons):
+  """Smallest zoom level at which each point has to be drawn, as an int array."""
+  n = len(lats)
+  if n == 0:
+    return np.zeros(0, dtype=int)
+  x, y = _project(lats, lons)
+  # eine Toleranz von einem Pixel bei der höchsten Zoomstufe reicht
+  sig = significance(x, y, METERS_PER_PIXEL / 2 ** MAX_ZOOM)
+  with np.errstate(divide='ignore'):
+    zooms = np.ceil(np.log2(METERS_PER_PIXEL / sig))
+  zooms[sig == 0] = MAX_ZOOM
+  return np.clip(zooms, 0, MAX_ZOOM).astype(int)
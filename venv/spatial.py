@@ -0,0 +1,108 @@
+"""Spatial index over tracks.
+
+Every track is cut into tiles of TILE_SIZE consecutive segments. The bounding
+box of each tile is kept in the SQLite R-tree models.track_tile_rtree with
+the track id and the index range of its points, so area queries only have to
+look at the points of tiles that overlap the area.
+"""
+import math
+
+import numpy as np
+from sqlalchemy import select
+
+from models import Track, track_tile_rtree
+from geo import EARTH_RADIUS, distances_from
+from point_store import load_points
+
+TILE_SIZE = 256
+
+def tile_boxes(lats, lons, size=TILE_SIZE):
+  """Cuts a run of points into tiles of size segments.
+
+  Returns (first, last, min_lat, max_lat, min_lon, max_lon) arrays; first and
+  last are inclusive and neighbouring tiles share their boundary point, so
+  every segment lies completely inside one tile.
+  """
+  lats = np.asarray(lats, dtype=float)
+  lons = np.asarray(lons, dtype=float)
+  n = len(lats)
+  if n == 0:
+    return tuple(np.zeros(0) for _ in range(6))
+  first = np.arange(0, max(n - 1, 1), size)
+  last = np.minimum(first + size, n - 1)
+  return (first, last,
+          np.minimum(np.minimum.reduceat(lats, first), lats[last]),
+          np.maximum(np.maximum.reduceat(lats, first), lats[last]),
+          np.minimum(np.minimum.reduceat(lons, first), lons[last]),
+          np.maximum(np.maximum.reduceat(lons, first), lons[last]))
+
+def index_points(conn, track_id, lats, lons, offset=0):
+  """Adds the tiles of a run of points starting at point index offset to the R-tree.
+
+  Returns the bounding box (min_lat, max_lat, min_lon, max_lon) of the run, or None if it is empty.
+  """
+  first, last, min_lat, max_lat, min_lon, max_lon = tile_boxes(lats, lons)
+  if len(first) == 0:
+    return None
+  rows = [{'min_lat': a, 'max_lat': b, 'min_lon': c, 'max_lon': d, 'track_id': track_id, 'first': offset + f, 'last': offset + l}
+          for f, l, a, b, c, d in zip(first.tolist(), last.tolist(), min_lat.tolist(), max_lat.tolist(), min_lon.tolist(), max_lon.tolist())]
+  conn.execute(track_tile_rtree.insert(), rows)
+  return float(min_lat.min()), float(max_lat.max()), float(min_lon.min()), float(max_lon.max())
+
+def set_track_bbox(conn, track_id, bbox):
+  if bbox is None:
+    return
+  min_lat, max_lat, min_lon, max_lon = bbox
+  table = Track.__table__
+  conn.execute(table.update().where(table.c.id == track_id).values(min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon))
+
+def index_track(conn, track_id):
+  """Builds the tiles and bounding box of an already stored track."""
+  points = load_points(conn, track_id)
+  set_track_bbox(conn, track_id, index_points(conn, track_id, points.lat, points.lon))
+
+def index_missing(engine):
+  """Indexes all tracks that have no tiles yet, e.g. from imports before the index existed. Returns their number."""
+  with engine.connect() as conn:
+    track_ids = conn.execute(select(Track.__table__.c.id)
+                             .where(Track.__table__.c.id.not_in(select(track_tile_rtree.c.track_id)))).scalars().all()
+  for track_id in track_ids:
+    with engine.begin() as conn:
+      index_track(conn, track_id)
+  return len(track_ids)
+
+def delete_track_tiles(conn, track_id):
+  conn.execute(track_tile_rtree.delete().where(track_tile_rtree.c.track_id == track_id))
+
+def _candidates(conn, south, west, north, east, track_ids=None):
+  r = track_tile_rtree.c
+  query = select(r.track_id, r.first, r.last).where(r.max_lat >= south, r.min_lat <= north, r.max_lon >= west, r.min_lon <= east)
+  if track_ids is not None:
+    query = query.where(r.track_id.in_(track_ids))
+  candidates = {}
+  for track_id, first, last in conn.execute(query):
+    candidates.setdefault(track_id, []).append((first, last))
+  return candidates
+
+def _refine(conn, candidates, matches):
+  """Keeps the candidate tracks with at least one point in their candidate tiles for which matches(lats, lons) holds."""
+  result = set()
+  for track_id, ranges in candidates.items():
+    points = load_points(conn, track_id)
+    for first, last in ranges:
+      if np.any(matches(points.lat[first:last + 1], points.lon[first:last + 1])):
+        result.add(track_id)
+        break
+  return result
+
+def tracks_in_area(conn, south, west, north, east, track_ids=None):
+  """Ids of the tracks with a point inside the box, optionally limited to a select of track ids."""
+  candidates = _candidates(conn, south, west, north, east, track_ids)
+  return _refine(conn, candidates, lambda lats, lons: (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east))
+
+def tracks_near(conn, lat, lon, radius, track_ids=None):
+  """Ids of the tracks with a point at most radius km away from (lat, lon)."""
+  dlat = math.degrees(radius / EARTH_RADIUS)
+  dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+  candidates = _candidates(conn, lat - dlat, lon - dlon, lat + dlat, lon + dlon, track_ids)
+  return _refine(conn, candidates, lambda lats, lons: distances_from(lat, lon, lats, lons) <= radius)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Compares the NumPy distance kernel with the original scalar haversine loop."""
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from geo import haversine, segment_distances, calculate_total_distance, calculate_avg_speed, profile, max_speed
+from gpx_parser import parse_gpx
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'GeoKoordinaten')
+SAMPLE_FILES = sorted(os.path.join(SAMPLES, name) for name in os.listdir(SAMPLES) if name.lower().endswith('.gpx')) if os.path.isdir(SAMPLES) else []
+
+def scalar_total_distance(coordinates):
+  """calculate_total_distance as it was before the NumPy kernel."""
+  total_distance = 0
+  if len(coordinates) > 1:
+    distances = []
+    for i in range(1, len(coordinates)):
+      lat1, lon1 = coordinates[i-1][0], coordinates[i-1][1]
+      lat2, lon2 = coordinates[i][0], coordinates[i][1]
+      distances.append(haversine(lat1, lon1, lat2, lon2))
+    total_distance = round(sum(distances),2)
+  return total_distance
+
+def point(lat, lon, time=None):
+  return (lat, lon, None, None, time)
+
+@pytest.mark.parametrize('file_path', SAMPLE_FILES, ids=os.path.basename)
+def test_sample_files(file_path):
+  for coordinates, *_ in parse_gpx(file_path):
+    expected = [haversine(a[0], a[1], b[0], b[1]) for a, b in zip(coordinates, coordinates[1:])]
+    np.testing.assert_allclose(segment_distances([c[0] for c in coordinates], [c[1] for c in coordinates]), expected, rtol=1e-9, atol=1e-12)
+    assert calculate_total_distance(coordinates) == pytest.approx(scalar_total_distance(coordinates), abs=0.011)
+
+@pytest.mark.parametrize('coordinates', [
+  [],
+  [point(50.0, 8.0)],
+  [point(50.0, 8.0), point(50.001, 8.001)],
+  [point(50.0, 8.0), point(50.0, 8.0), point(50.0, 8.0)],
+  [point(50.0, 8.0), point(50.0, 8.0), point(50.01, 8.0), point(50.01, 8.0)],
+  [point(-33.9, 151.2), point(51.5, -0.1)],
+], ids=['empty', 'one point', 'two points', 'repeated', 'repeated between moves', 'antipodal-ish'])
+def test_edge_cases(coordinates):
+  assert calculate_total_distance(coordinates) == scalar_total_distance(coordinates)
+  assert len(segment_distances([c[0] for c in coordinates], [c[1] for c in coordinates])) == max(len(coordinates) - 1, 0)
+
+def test_profile_with_missing_times():
+  start = datetime(2024, 1, 1, 12)
+  coordinates = [point(50.0, 8.0, start), point(50.001, 8.0), point(50.002, 8.0, start + timedelta(seconds=20)),
+                 point(50.003, 8.0, start + timedelta(seconds=20)), point(50.004, 8.0, start + timedelta(seconds=30))]
+  distances, speeds, elevation_gain = profile(coordinates)
+
+  expected = [0.0] + [haversine(a[0], a[1], b[0], b[1]) for a, b in zip(coordinates, coordinates[1:])]
+  np.testing.assert_allclose(distances, expected, rtol=1e-9)
+  # ohne Zeit oder ohne Zeitfortschritt gibt es keine Geschwindigkeit
+  assert np.isnan(speeds[:4]).all()
+  assert speeds[4] == pytest.approx(expected[4] / 10 * 3600)
+  assert elevation_gain == 0
+
+def test_max_speed_ignores_jitter():
+  # 10 Minuten mit 36 km/h nach Norden, ein Ausreißer springt 300 m zur Seite
+  times = np.arange(600, dtype=float)
+  lats = 50 + times * 0.01 / 111.195
+  lons = np.full(600, 8.0)
+  lons[300] += 0.3 / (111.195 * np.cos(np.radians(lats[300])))
+  assert max_speed(lats, lons, times) == pytest.approx(36, rel=0.01)
+  assert max_speed(lats[:20], lons[:20], times[:20]) is None
+
+def test_avg_speed_without_elapsed_time():
+  time = datetime(2024, 1, 1, 12)
+  assert calculate_avg_speed(1.5, time, time) == 0
+  assert calculate_avg_speed(1.5, time, time + timedelta(minutes=30)) == 3.0